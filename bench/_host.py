@@ -0,0 +1,47 @@
+# Helpers for running main.py under a host CPython interpreter.
+# The 'network' module only exists on the device, so a stub is installed
+# before main.py is imported; everything else runs unmodified.
+import os
+import sys
+import tempfile
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def loadMain():
+    if 'network' not in sys.modules:
+        network = types.ModuleType('network')
+        network.STA_IF = 0
+
+        def WLAN(interface):
+            raise RuntimeError('network.WLAN is not available on the host')
+
+        network.WLAN = WLAN
+        sys.modules['network'] = network
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    import main
+    return main
+
+
+def makeSandbox():
+    # main.py works relative to the current directory ('./files'), so each
+    # run gets its own scratch directory
+    path = tempfile.mkdtemp(prefix='esp32-httpd-')
+    os.chdir(path)
+    os.mkdir('files')
+    return path
+
+
+class Quiet:
+    # main.py logs every request with print(); keep it out of the timings
+
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        return self
+
+    def __exit__(self, *exc):
+        sys.stdout.close()
+        sys.stdout = self.stdout
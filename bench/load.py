@@ -0,0 +1,86 @@
+# Host load harness: runs HTTPServer on localhost and hammers it with
+# concurrent GETs, once per worker-thread setting, so the single-threaded
+# loop and the worker pool can be compared on the same machine.
+#
+#   python bench/load.py [--workers 0,1] [--clients 4] [--seconds 5] [--size 65536]
+import argparse
+import socket
+import threading
+import time
+
+from _host import Quiet, loadMain, makeSandbox
+
+
+def startServer(main, workers):
+    server = main.HTTPServer(port=0, config={'worker_threads': workers})
+    port = server.socket.getsockname()[1]
+    thread = threading.Thread(target=server.serveForever)
+    thread.daemon = True
+    thread.start()
+    return server, port
+
+
+def fetch(port, path):
+    sock = socket.create_connection(('127.0.0.1', port))
+    try:
+        sock.sendall(b'GET ' + path.encode() + b' HTTP/1.1\r\nHost: bench\r\n\r\n')
+        received = 0
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            received += len(chunk)
+        return received
+    finally:
+        sock.close()
+
+
+def runLoad(port, path, clients, seconds):
+    deadline = time.time() + seconds
+    totals = []
+    lock = threading.Lock()
+
+    def client():
+        requests = 0
+        received = 0
+        while time.time() < deadline:
+            received += fetch(port, path)
+            requests += 1
+        with lock:
+            totals.append((requests, received))
+
+    threads = [threading.Thread(target=client) for i in range(clients)]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started
+    requests = sum(t[0] for t in totals)
+    received = sum(t[1] for t in totals)
+    return requests / elapsed, received / elapsed / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', default='0,1')
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--size', type=int, default=64 * 1024)
+    args = parser.parse_args()
+
+    makeSandbox()
+    with open('files/blob.bin', 'wb') as f:
+        f.write(b'\xa5' * args.size)
+    server_module = loadMain()
+
+    print('workers  clients  req/s     MiB/s')
+    for workers in [int(w) for w in args.workers.split(',')]:
+        with Quiet():
+            server, port = startServer(server_module, workers)
+            rate, throughput = runLoad(port, '/blob.bin', args.clients, args.seconds)
+        print('%-8d %-8d %-9.1f %.2f' % (workers, args.clients, rate, throughput))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+# Microbenchmarks for the pure helpers that run on every request.
+# Each case reports ns/op and the peak bytes allocated by one call
+# (tracemalloc), so changes to the helpers can be compared across commits:
+#
+#   python bench/micro.py --json before.json
+#   ... change main.py ...
+#   python bench/micro.py --compare before.json
+import argparse
+import gc
+import json
+import os
+import time
+import tracemalloc
+
+from _host import Quiet, loadMain, makeSandbox
+
+
+def buildCases(main):
+    server = object.__new__(main.HTTPServer)
+    server.content_types = dict(main.CONTENT_TYPES)
+    renderer = main.TemplateRenderer()
+
+    with open('files/small.html', 'w') as f:
+        f.write('<html><body><h1>{{ title }}</h1>{{body}}</body></html>')
+    big_keys = ['key%d' % i for i in range(50)]
+    with open('files/big.html', 'w') as f:
+        for i in range(400):
+            f.write('<p>row %d {{ %s }} and {{%s}}</p>\n' % (i, big_keys[i % 50], big_keys[(i * 7) % 50]))
+    big_context = {}
+    for key in big_keys:
+        big_context[key] = 'value of ' + key
+
+    long_path = '/' + '/'.join(['dir%d' % i if i % 5 else '..' for i in range(64)]) + '//file.txt'
+    escaped = '%41%2F%20' * 400
+    form_fields = '&'.join('field%d=value+%%2F%d' % (i, i) for i in range(2000))
+    part_headers = '\r\n'.join(['X-Extra-%d: %s' % (i, 'v' * 20) for i in range(50)] +
+                               ['Content-Disposition: form-data; name="file"; filename="report 2024.csv"',
+                                'Content-Type: text/csv'])
+    # A 4 KiB upload chunk with no boundary in it; the memoryview has no find()
+    # and takes the windowed path MicroPython's bytearray does
+    chunk = bytearray(b'x' * 4096)
+    delimiter = b'\r\n--' + b'-' * 26 + b'735323031399963166993862150'
+
+    return [
+        ('sanitizePath/short', main.sanitizePath, ('/files/index.html',)),
+        ('sanitizePath/long', main.sanitizePath, (long_path,)),
+        ('urlEncode/short', main.urlEncode, ('/docs/hello world.txt',)),
+        ('urlEncode/long', main.urlEncode, ('a b&c/d?e=f' * 200,)),
+        ('urlDecode/short', main.urlDecode, ('/docs/hello%20world.txt',)),
+        ('urlDecode/escapes', main.urlDecode, (escaped,)),
+        ('urlDecode/malformed', main.urlDecode, ('%%zz%4' * 300,)),
+        ('parseRequestLine/short', server.parseRequestLine, ('GET /files/a/b.txt HTTP/1.1',)),
+        ('parseRequestLine/query', server.parseRequestLine, ('GET /files/move_confirm/a?' + 'x' * 4000 + ' HTTP/1.1',)),
+        ('parseFormData/small', server.parseFormData, (b'new_name=my+file.txt',)),
+        ('parseFormData/2000', server.parseFormData, (form_fields.encode(),)),
+        ('parseQueryString/small', main.parseQueryString, ('dest_dir=%2Fdata%2Flogs',)),
+        ('parseQueryString/2000', main.parseQueryString, (form_fields,)),
+        ('parsePartHeaders/typical', server.parsePartHeaders, ('Content-Disposition: form-data; name="file"; filename="a.bin"\r\nContent-Type: application/octet-stream',)),
+        ('parsePartHeaders/many', server.parsePartHeaders, (part_headers,)),
+        ('getContentType/html', server.getContentType, ('/files/index.html',)),
+        ('getContentType/unknown', server.getContentType, ('/files/archive.tar.xz',)),
+        ('findBytes/native', main.findBytes, (chunk, delimiter, 0, len(chunk))),
+        ('findBytes/window', main.findBytes, (memoryview(chunk), delimiter, 0, len(chunk))),
+        ('render/small', renderer.render, ('small.html', {'title': 'Home', 'body': 'text'})),
+        ('render/big', renderer.render, ('big.html', big_context)),
+    ]
+
+
+def timeCase(func, args, min_time):
+    # Grow the batch until it runs long enough to time reliably
+    iterations = 1
+    while True:
+        started = time.perf_counter_ns()
+        for i in range(iterations):
+            func(*args)
+        elapsed = time.perf_counter_ns() - started
+        if elapsed >= min_time * 1e9:
+            return elapsed / iterations
+        iterations *= 2
+
+
+def peakBytes(func, args):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        func(*args)
+        return tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--min-time', type=float, default=0.2, help='seconds per case')
+    parser.add_argument('--filter', default='', help='only run cases containing this text')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--compare', help='compare against a previous --json file')
+    args = parser.parse_args()
+    # makeSandbox() changes directory; result files are relative to where we were started
+    if args.json:
+        args.json = os.path.abspath(args.json)
+    if args.compare:
+        args.compare = os.path.abspath(args.compare)
+
+    makeSandbox()
+    with Quiet():
+        server_module = loadMain()
+    cases = buildCases(server_module)
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    results = {}
+    print('%-28s %12s %12s %10s' % ('case', 'ns/op', 'peak B/op', 'vs base'))
+    for name, func, call_args in cases:
+        if args.filter not in name:
+            continue
+        with Quiet():
+            ns = timeCase(func, call_args, args.min_time)
+            peak = peakBytes(func, call_args)
+        results[name] = {'ns_per_op': ns, 'peak_bytes_per_op': peak}
+        change = ''
+        if name in baseline:
+            change = '%+.1f%%' % ((ns / baseline[name]['ns_per_op'] - 1) * 100)
+        print('%-28s %12.0f %12d %10s' % (name, ns, peak, change))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
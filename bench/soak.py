@@ -0,0 +1,131 @@
+# Long-running soak: drives a mixed workload (listings, static files,
+# uploads, move pages, archives) and samples /admin/stats so heap health can
+# be followed over time. Against a device the interesting columns are
+# mem_free and largest_free_block, which should stay flat if request handling
+# is not fragmenting the heap; on the host the in-process server's traced
+# Python heap is reported instead.
+#
+#   python bench/soak.py --host 192.168.1.50 --minutes 120
+#   python bench/soak.py --minutes 2            (local in-process server)
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+
+from _host import loadMain, makeSandbox
+
+BOUNDARY = b'soakboundary'
+
+
+def request(host, port, raw):
+    sock = socket.create_connection((host, port), timeout=30)
+    try:
+        sock.sendall(raw)
+        response = b''
+        while True:
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            response += chunk
+        return response
+    finally:
+        sock.close()
+
+
+def get(host, port, path):
+    return request(host, port, b'GET ' + path.encode() + b' HTTP/1.1\r\nHost: soak\r\n\r\n')
+
+
+def upload(host, port, name, data):
+    body = (b'--' + BOUNDARY + b'\r\nContent-Disposition: form-data; name="file"; filename="' + name.encode() +
+            b'"\r\nContent-Type: application/octet-stream\r\n\r\n' + data + b'\r\n--' + BOUNDARY + b'--\r\n')
+    head = (b'POST /files/upload/ HTTP/1.1\r\nHost: soak\r\nContent-Type: multipart/form-data; boundary=' +
+            BOUNDARY + b'\r\nContent-Length: ' + str(len(body)).encode() + b'\r\n\r\n')
+    return request(host, port, head + body)
+
+
+def stats(host, port):
+    response = get(host, port, '/admin/stats')
+    return json.loads(response.split(b'\r\n\r\n', 1)[1])
+
+
+def startLocalServer():
+    makeSandbox()
+    main = loadMain()
+    server = main.HTTPServer(port=0)
+    thread = threading.Thread(target=server.serveForever)
+    thread.daemon = True
+    thread.start()
+    return server.socket.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', help='device address; omit to soak a local in-process server')
+    parser.add_argument('--port', type=int, default=80)
+    parser.add_argument('--minutes', type=float, default=2)
+    parser.add_argument('--interval', type=float, default=10, help='seconds between samples')
+    args = parser.parse_args()
+
+    local = args.host is None
+    host = '127.0.0.1' if local else args.host
+    report = sys.stdout
+    if local:
+        # The server logs every request from its own thread; silence it for the whole run
+        sys.stdout = open(os.devnull, 'w')
+        tracemalloc.start()
+        port = startLocalServer()
+    else:
+        port = args.port
+
+    payload = bytes(range(256)) * 32
+    upload(host, port, 'soak.bin', payload)
+    workload = [
+        lambda: get(host, port, '/files'),
+        lambda: get(host, port, '/soak.bin'),
+        lambda: upload(host, port, 'soak-upload.bin', payload[:3000]),
+        lambda: get(host, port, '/files/move/soak.bin'),
+        lambda: get(host, port, '/files/?action=archive'),
+        lambda: get(host, port, '/index.html'),
+    ]
+
+    report.write('%8s %9s %7s %10s %12s %10s %10s' % ('seconds', 'requests', 'errors', 'mem_free', 'largest_free', 'exhausted', 'py_heap_k') + '\n')
+    started = time.time()
+    deadline = started + args.minutes * 60
+    next_sample = started
+    requests = 0
+    errors = 0
+    samples = []
+    while True:
+        now = time.time()
+        if now >= next_sample or now >= deadline:
+            sample = stats(host, port)
+            heap = tracemalloc.get_traced_memory()[0] // 1024 if local else ''
+            largest = sample.get('largest_free_block')
+            samples.append(largest)
+            report.write('%8d %9d %7d %10s %12s %10s %10s\n' % (
+                now - started, requests, errors, sample['admission']['mem_free'], largest,
+                sample['buffer_pool']['exhausted'], heap))
+            report.flush()
+            next_sample = now + args.interval
+            if now >= deadline:
+                break
+        try:
+            response = workload[requests % len(workload)]()
+            if not response.startswith(b'HTTP/1.1 2') and not response.startswith(b'HTTP/1.1 3'):
+                errors += 1
+        except OSError:
+            errors += 1
+        requests += 1
+
+    known = [sample for sample in samples if sample is not None]
+    if known:
+        report.write('largest free block: first %d, min %d, last %d\n' % (known[0], min(known), known[-1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,7 +5,148 @@ import network
 import os
 import socket
 import sys
-
+import time
+
+try:
+    import threading
+except ImportError:
+    threading = None
+try:
+    import _thread
+except ImportError:
+    _thread = None
+
+
+def allocateLock():
+    if threading is not None:
+        return threading.Lock()
+    return _thread.allocate_lock()
+
+def startThread(target):
+    if threading is not None:
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
+    else:
+        _thread.start_new_thread(target, ())
+
+# Content types by file extension; 'mime_types' in config.json adds to or overrides these
+CONTENT_TYPES = {
+    '.html': 'text/html',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.css': 'text/css',
+    '.js': 'application/javascript',
+}
+
+# MicroPython ports with a 2000-01-01 epoch report mtimes that need shifting for tar
+EPOCH_OFFSET = 946684800 if time.gmtime(0)[0] == 2000 else 0
+
+def memFree():
+    # gc.mem_free() only exists on MicroPython; None means 'unknown'
+    try:
+        return gc.mem_free()
+    except AttributeError:
+        return None
+
+def largestFreeBlock():
+    # MicroPython has no call that reports this, so probe with a binary
+    # search of allocations; only meant for occasional diagnostics
+    free = memFree()
+    if free is None:
+        return None
+    low = 0
+    high = free
+    while high - low > 64:
+        size = (low + high) // 2
+        try:
+            block = bytearray(size)
+            del block
+            low = size
+        except MemoryError:
+            high = size
+    return low
+
+def recvInto(client_sock, view):
+    # Receive up to len(view) bytes into a borrowed buffer. MicroPython sockets
+    # have no recv_into() and their readinto() waits for the full length, so
+    # there the data is received normally and copied in
+    recv_into = getattr(client_sock, 'recv_into', None)
+    if recv_into is not None:
+        return recv_into(view)
+    data = client_sock.recv(len(view))
+    view[:len(data)] = data
+    return len(data)
+
+def recvExactly(client_sock, view):
+    # For request bodies, where len(view) bytes are known to be on their way
+    readinto = getattr(client_sock, 'readinto', None)
+    if readinto is not None:
+        return readinto(view)
+    return recvInto(client_sock, view)
+
+# Bytes copied per bytes.find() call when a buffer has no find() of its own
+FIND_WINDOW = 512
+
+def findBytes(buffer, pattern, start, end):
+    # bytearray.find() where the port has it. MicroPython's bytearray has none;
+    # there the range is copied to bytes one FIND_WINDOW at a time so the search
+    # still runs in native code while each copy stays small and short-lived
+    find = getattr(buffer, 'find', None)
+    if find is not None:
+        return find(pattern, start, end)
+    view = memoryview(buffer)
+    # Windows overlap by len(pattern) - 1 so a match across their edge is found
+    step = max(1, FIND_WINDOW - len(pattern) + 1)
+    while end - start >= len(pattern):
+        window_end = min(end, start + FIND_WINDOW)
+        index = bytes(view[start:window_end]).find(pattern)
+        if index != -1:
+            return start + index
+        if window_end == end:
+            break
+        start += step
+    return -1
+
+def shiftDown(buffer, start, end):
+    # Moves buffer[start:end] to the front in place and returns its length
+    length = end - start
+    if length <= start:
+        view = memoryview(buffer)
+        view[:length] = view[start:end]
+    else:
+        # Overlapping ranges; copying forwards never reads a byte already overwritten
+        for index in range(length):
+            buffer[index] = buffer[start + index]
+    return length
+
+def nextItem(generator):
+    # next() for use as a worker job; StopIteration would not survive the trip
+    # back to the caller, so the end of the generator comes back as None
+    try:
+        return next(generator)
+    except StopIteration:
+        return None
+
+def threadId():
+    if threading is not None:
+        return threading.get_ident()
+    if _thread is not None:
+        return _thread.get_ident()
+    return 0
+
+# Microsecond timer for the profiler: ticks_us() on MicroPython, perf_counter_ns() elsewhere
+if hasattr(time, 'ticks_us'):
+    ticksUs = time.ticks_us
+    ticksDiff = time.ticks_diff
+else:
+    def ticksUs():
+        return time.perf_counter_ns() // 1000
+
+    def ticksDiff(end, start):
+        return end - start
 
 def readConfig():
     config = {}
@@ -62,7 +203,7 @@ def dirname(path):
         return '/'
     parts = path.rstrip('/').split('/')
     if len(parts) > 1:
-        return '/' + '/'.join(parts[:-1])
+        return '/' + '/'.join(parts[:-1]).lstrip('/')
     else:
         return '/'
 
@@ -101,6 +242,159 @@ def urlDecode(s):
             i += 1
     return res
 
+def parseQueryString(query_string):
+    params = {}
+    pairs = query_string.split('&')
+    for pair in pairs:
+        if '=' in pair:
+            key, value = pair.split('=', 1)
+            key = key.replace('+', ' ')
+            value = value.replace('+', ' ')
+            key = urlDecode(key)
+            value = urlDecode(value)
+            params[key] = value
+    return params
+
+def tarHeader(name, is_dir, size, mtime):
+    # ustar header block; returns None when the name cannot be represented
+    if is_dir:
+        name += '/'
+        size = 0
+    name = name.encode('utf-8')
+    prefix = b''
+    if len(name) > 100:
+        # Split at a '/' so the prefix fits in 155 bytes and the rest in 100
+        split = name.find(b'/', len(name) - 101)
+        if split == -1 or split > 155:
+            return None
+        prefix = name[:split]
+        name = name[split + 1:]
+    header = bytearray(512)
+    header[0:len(name)] = name
+    header[100:108] = b'0000755\0' if is_dir else b'0000644\0'
+    header[108:116] = b'0000000\0'
+    header[116:124] = b'0000000\0'
+    header[124:136] = ('%011o' % size).encode() + b'\0'
+    header[136:148] = ('%011o' % (mtime + EPOCH_OFFSET)).encode() + b'\0'
+    header[148:156] = b'        '
+    header[156] = ord('5') if is_dir else ord('0')
+    header[257:265] = b'ustar\x0000'
+    header[345:345 + len(prefix)] = prefix
+    header[148:156] = ('%06o' % sum(header)).encode() + b'\0 '
+    return header
+
+def parseTarHeader(header):
+    # Returns (name, typeflag, size), or None if the checksum does not match
+    try:
+        checksum = int(header[148:156].decode().strip('\0 ') or '0', 8)
+        size = int(header[124:136].decode().strip('\0 ') or '0', 8)
+    except ValueError:
+        return None
+    if checksum != sum(header[:148]) + 256 + sum(header[156:]):
+        return None
+    name = header[0:100].split(b'\0')[0].decode('utf-8', 'ignore')
+    if header[257:262] == b'ustar':
+        prefix = header[345:500].split(b'\0')[0].decode('utf-8', 'ignore')
+        if prefix:
+            name = prefix + '/' + name
+    return name, chr(header[156]), size
+
+class BodyReader:
+
+    def __init__(self, client_sock, initial_data, content_length):
+        self.client_sock = client_sock
+        self.initial = memoryview(initial_data)
+        self.remaining = content_length - len(initial_data)
+
+    def readinto(self, view):
+        # Fills view unless the body ends first; returns the number of bytes read
+        view = memoryview(view)
+        count = min(len(self.initial), len(view))
+        if count:
+            view[:count] = self.initial[:count]
+            self.initial = self.initial[count:]
+        while count < len(view) and self.remaining > 0:
+            received = recvExactly(self.client_sock, view[count:count + min(len(view) - count, self.remaining)])
+            if not received:
+                self.remaining = 0
+                break
+            self.remaining -= received
+            count += received
+        return count
+
+class Request:
+    # Headers stay as raw bytes in the pooled receive buffer and are parsed one
+    # at a time on first access; the decoded path, sanitized sub path and query
+    # dict are computed once. Only valid while the request is being handled
+    __slots__ = ('method', 'path', 'params', 'body', 'header_data', 'headers_start',
+                 'headers_end', '_headers', '_decoded_path', '_sub_path', '_query')
+
+    def __init__(self, method, path, params, header_data, headers_start, headers_end, body=None):
+        self.method = method
+        self.path = path
+        self.params = params
+        self.body = body
+        self.header_data = header_data
+        self.headers_start = headers_start
+        self.headers_end = headers_end
+        self._headers = None
+        self._decoded_path = None
+        self._sub_path = None
+        self._query = None
+
+    def header(self, name, default=''):
+        if self._headers is None:
+            self._headers = {}
+        elif name in self._headers:
+            value = self._headers[name]
+            return default if value is None else value
+        # Walk the header lines comparing names case-insensitively in place;
+        # name is lower case, and values such as the multipart boundary keep their case
+        data = self.header_data
+        key = name.encode('utf-8')
+        value = None
+        line_end = self.headers_start
+        while line_end != -1:
+            start = line_end + 2
+            line_end = findBytes(data, b'\r\n', start, self.headers_end)
+            end = self.headers_end if line_end == -1 else line_end
+            if end - start <= len(key) or data[start + len(key)] != 58:  # ':'
+                continue
+            offset = 0
+            while offset < len(key) and data[start + offset] | 0x20 == key[offset]:
+                offset += 1
+            if offset == len(key):
+                value = str(memoryview(data)[start + len(key) + 1:end], 'utf-8', 'ignore').strip()
+                break
+        self._headers[name] = value
+        return default if value is None else value
+
+    @property
+    def contentLength(self):
+        try:
+            return int(self.header('content-length', '0'))
+        except ValueError:
+            return 0
+
+    @property
+    def decodedPath(self):
+        if self._decoded_path is None:
+            self._decoded_path = urlDecode(self.path)
+        return self._decoded_path
+
+    @property
+    def subPath(self):
+        # Sanitized path below '/files'
+        if self._sub_path is None:
+            self._sub_path = sanitizePath(urlDecode(self.path[len('/files'):]))
+        return self._sub_path
+
+    @property
+    def query(self):
+        if self._query is None:
+            self._query = parseQueryString(self.params.lstrip('?'))
+        return self._query
+
 class WiFiConnection:
 
     def __init__(self, ssid, password):
@@ -146,18 +440,27 @@ class FileManager:
 
     def __init__(self, base_dir='./files'):
         self.base_dir = base_dir.rstrip('/')
-        base_dir = base_dir.lstrip('.').lstrip('/')
         # Check for files directory and create if required
-        if (not 'files' in os.listdir()):
-            os.mkdir('/files')
+        if not isDir(self.base_dir):
+            os.mkdir(self.base_dir)
             print('Created /files directory')
         # Check for index.html and create if required
-        file_path = '/files/index.html'
-        if not 'index.html' in os.listdir('/files'):
+        file_path = self.base_dir + '/index.html'
+        if not 'index.html' in os.listdir(self.base_dir):
             html_content = '<html><head><title>Home Page</title></head><body><h1>Home Page</h1>Data: {{ title }}<br><br><a href="/files">Edit Files</a></body></html>'
             with open(file_path, 'w') as f:
                 f.write(html_content)
             print('Created /files/index.html')
+        self.change_listeners = []
+
+    def addChangeListener(self, listener):
+        # listener(path, is_dir) is called after every successful mutation,
+        # with path relative to base_dir
+        self.change_listeners.append(listener)
+
+    def notifyChange(self, path, is_dir):
+        for listener in self.change_listeners:
+            listener(path, is_dir)
 
     def listItems(self, path='/'):
         target_dir = self.base_dir + sanitizePath(path)
@@ -191,6 +494,21 @@ class FileManager:
                 directories.extend(self.getAllDirectories(item_path, exclude))
         return directories
 
+    def walk(self, path='/'):
+        # Depth first; yields (item_path, is_dir, size, mtime) with each
+        # directory ahead of its contents
+        path = sanitizePath(path)
+        for item in self.listItems(path):
+            item_path = path + '/' + item if path != '/' else '/' + item
+            try:
+                stat = os.stat(self.base_dir + item_path)
+            except OSError:
+                continue
+            is_dir = (stat[0] & 0x4000) == 0x4000
+            yield item_path, is_dir, stat[6], stat[8]
+            if is_dir:
+                yield from self.walk(item_path)
+
     def readFile(self, file_path):
         full_path = self.base_dir + sanitizePath(file_path)
         if not isFile(full_path):
@@ -203,23 +521,28 @@ class FileManager:
             return None
 
     def saveFile(self, file_path, data):
-        full_path = self.base_dir + sanitizePath(file_path)
+        file_path = sanitizePath(file_path)
+        full_path = self.base_dir + file_path
         try:
             with open(full_path, 'wb') as file:
                 file.write(data)
             print('File saved to:', full_path)
+            self.notifyChange(file_path, False)
         except Exception as e:
             print('Error saving file', full_path, ':', e)
 
     def deleteItem(self, item_path):
-        full_path = self.base_dir + sanitizePath(item_path)
+        item_path = sanitizePath(item_path)
+        full_path = self.base_dir + item_path
         try:
             if isFile(full_path):
                 os.remove(full_path)
                 print('File deleted:', full_path)
+                self.notifyChange(item_path, False)
             elif isDir(full_path):
                 os.rmdir(full_path)
                 print('Directory deleted:', full_path)
+                self.notifyChange(item_path, True)
         except OSError as e:
             print('Error deleting item', full_path, ':', e)
             return "Directory not empty."
@@ -227,23 +550,29 @@ class FileManager:
             print('Unexpected error deleting item', full_path, ':', e)
 
     def renameItem(self, old_path, new_name):
-        full_old_path = self.base_dir + sanitizePath(old_path)
+        old_path = sanitizePath(old_path)
+        full_old_path = self.base_dir + old_path
         new_name = new_name.strip('/').replace('/', '_')  # Prevent directory traversal
-        new_dir = dirname(full_old_path)
+        new_dir = self.base_dir + dirname(old_path)
         full_new_path = new_dir + '/' + new_name
         try:
             if exists(full_old_path):
+                is_dir = isDir(full_old_path)
                 os.rename(full_old_path, full_new_path)
                 print('Renamed', full_old_path, 'to', full_new_path)
+                self.notifyChange(old_path, is_dir)
+                self.notifyChange(sanitizePath(dirname(old_path) + '/' + new_name), is_dir)
         except Exception as e:
             print('Error renaming item:', e)
 
     def createDirectory(self, dir_path):
-        full_path = self.base_dir + sanitizePath(dir_path)
+        dir_path = sanitizePath(dir_path)
+        full_path = self.base_dir + dir_path
         try:
             if not exists(full_path):
                 os.mkdir(full_path)
                 print('Directory created:', full_path)
+                self.notifyChange(dir_path, True)
         except Exception as e:
             print('Error creating directory', full_path, ':', e)
 
@@ -257,8 +586,11 @@ class FileManager:
             print('Source:', full_src_path)
             print('Destination:', full_dest_path)
             try:
+                is_dir = isDir(full_src_path)
                 os.rename(full_src_path, full_dest_path)
                 print('Move successful.')
+                self.notifyChange(sanitizePath(src_path), is_dir)
+                self.notifyChange(sanitizePath(dest_dir + '/' + item_name), is_dir)
             except Exception as e:
                 print('Error moving item:', e)
         else:
@@ -267,32 +599,605 @@ class FileManager:
             print('Destination exists:', exists(dest_dir_path))
 
 
+class ResponseWriter:
+
+    def __init__(self, buffer_size=1536):
+        # Status line, headers and small bodies are assembled in this buffer so
+        # they leave in a single send() instead of racing Nagle/delayed ACK
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.length = 0
+
+    def append(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        end = self.length + len(data)
+        if end > len(self.buffer):
+            return False
+        self.buffer[self.length:end] = data
+        self.length = end
+        return True
+
+    def write(self, client_sock, data):
+        if self.append(data):
+            return
+        self.flush(client_sock)
+        if not self.append(data):
+            # Too big for the buffer; send it straight from the caller's memory
+            self.writeAll(client_sock, data)
+
+    def flush(self, client_sock):
+        if self.length:
+            length = self.length
+            self.length = 0
+            self.writeAll(client_sock, self.view[:length])
+
+    def writeAll(self, client_sock, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        view = memoryview(data)
+        total = len(view)
+        sent = 0
+        while sent < total:
+            try:
+                count = client_sock.send(view[sent:])
+            except OSError as e:
+                if e.args[0] == errno.EAGAIN:
+                    continue
+                raise
+            if not count:
+                raise OSError(errno.ECONNRESET)
+            sent += count
+
+    def begin(self, client_sock, status, content_type=None, content_length=None, headers=None):
+        # Headers go through write() so a block larger than the buffer is
+        # flushed in pieces instead of being cut short
+        self.length = 0
+        self.write(client_sock, 'HTTP/1.1 ')
+        self.write(client_sock, status)
+        self.write(client_sock, '\r\n')
+        if content_type is not None:
+            self.write(client_sock, 'Content-Type: ')
+            self.write(client_sock, content_type)
+            self.write(client_sock, '\r\n')
+        if status.startswith('304'):
+            # No body and no framing headers; a Content-Length here would have
+            # to repeat the 200 body length (RFC 7230 section 3.3.2)
+            pass
+        elif content_length is None:
+            self.write(client_sock, 'Transfer-Encoding: chunked\r\n')
+        else:
+            self.write(client_sock, 'Content-Length: ')
+            self.write(client_sock, str(content_length))
+            self.write(client_sock, '\r\n')
+        if headers:
+            for key, value in headers.items():
+                self.write(client_sock, key)
+                self.write(client_sock, ': ')
+                self.write(client_sock, str(value))
+                self.write(client_sock, '\r\n')
+        self.write(client_sock, 'Connection: close\r\n\r\n')
+
+    def sendResponse(self, client_sock, content, content_type='text/html', status='200 OK', headers=None):
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        self.begin(client_sock, status, content_type, len(content), headers)
+        self.write(client_sock, content)
+        self.flush(client_sock)
+
+    def sendStream(self, client_sock, content_generator, content_type='application/octet-stream', status='200 OK', content_length=None, headers=None):
+        # Without a known length the body goes out with chunked transfer encoding
+        chunked = content_length is None
+        try:
+            self.begin(client_sock, status, content_type, content_length, headers)
+            for chunk in content_generator:
+                if not chunk:
+                    continue
+                if chunked:
+                    self.write(client_sock, '%x\r\n' % len(chunk))
+                    self.write(client_sock, chunk)
+                    self.write(client_sock, b'\r\n')
+                else:
+                    self.write(client_sock, chunk)
+            if chunked:
+                self.write(client_sock, b'0\r\n\r\n')
+            self.flush(client_sock)
+        finally:
+            # MicroPython does not finalize abandoned generators, so a failed
+            # send must close it to release its pooled buffers and open files
+            close = getattr(content_generator, 'close', None)
+            if close is not None:
+                close()
+
+    def sendRedirect(self, client_sock, location):
+        self.begin(client_sock, '303 See Other', content_length=0, headers={'Location': location})
+        self.flush(client_sock)
+
+
+class BufferPool:
+
+    # (buffer size, count) for each size class
+    SIZE_CLASSES = ((1024, 4), (2048, 2), (4096, 2))
+
+    def __init__(self, size_classes=None):
+        # Allocated once at startup so request handling does not keep carving
+        # new blocks out of the heap and fragmenting it
+        self.classes = []
+        for size, count in size_classes or self.SIZE_CLASSES:
+            self.classes.append((size, count, [bytearray(size) for i in range(count)]))
+        self.lock = allocateLock()
+        self.in_use = 0
+        self.borrows = 0
+        self.exhausted = 0
+
+    def borrow(self, size):
+        # Smallest free buffer of at least size bytes; a fresh one when the pool runs dry
+        with self.lock:
+            self.borrows += 1
+            for class_size, count, free in self.classes:
+                if class_size >= size and free:
+                    self.in_use += 1
+                    return free.pop()
+            self.exhausted += 1
+        print('Buffer pool exhausted for', size, 'bytes')
+        return bytearray(size)
+
+    def release(self, buffer):
+        with self.lock:
+            for class_size, count, free in self.classes:
+                if len(buffer) == class_size and len(free) < count:
+                    if not any(item is buffer for item in free):
+                        free.append(buffer)
+                        self.in_use -= 1
+                    return
+        # Buffers allocated on exhaustion are left to the garbage collector
+
+    def stats(self):
+        free = {}
+        for class_size, count, buffers in self.classes:
+            free[class_size] = len(buffers)
+        return {'in_use': self.in_use, 'borrows': self.borrows, 'exhausted': self.exhausted, 'free': free}
+
+
+class WorkerJob:
+
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.value = None
+        self.error = None
+        # Held until the job has run; result() blocks on it
+        self.done = allocateLock()
+        self.done.acquire()
+
+    def run(self):
+        try:
+            self.value = self.func(*self.args)
+        except Exception as e:
+            self.error = e
+        self.done.release()
+
+    def result(self):
+        self.done.acquire()
+        self.done.release()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class WorkerPool:
+
+    def __init__(self, workers=1, queue_size=4):
+        self.queue = []
+        self.queue_size = queue_size
+        self.mutex = allocateLock()
+        # 'pending' is released while the queue holds jobs, 'space' while it is
+        # not full; together they give blocking take() and bounded submit()
+        self.pending = allocateLock()
+        self.pending.acquire()
+        self.space = allocateLock()
+        for i in range(workers):
+            startThread(self.workerLoop)
+        print('Worker pool started with', workers, 'thread(s)')
+
+    def submit(self, func, *args):
+        job = WorkerJob(func, args)
+        # Blocks the network thread while the queue is full (backpressure)
+        self.space.acquire()
+        with self.mutex:
+            self.queue.append(job)
+            if len(self.queue) < self.queue_size:
+                self.space.release()
+            if len(self.queue) == 1:
+                self.pending.release()
+        return job
+
+    def take(self):
+        self.pending.acquire()
+        with self.mutex:
+            job = self.queue.pop(0)
+            if len(self.queue) > 0:
+                self.pending.release()
+            if len(self.queue) == self.queue_size - 1:
+                self.space.release()
+        return job
+
+    def workerLoop(self):
+        while True:
+            self.take().run()
+
+
+class PooledWriter:
+
+    def __init__(self, pool, file, buffer_pool):
+        self.pool = pool
+        self.file = file
+        self.buffer_pool = buffer_pool
+        # Data is copied here before the write is handed off, so the caller can
+        # reuse its own buffer for the next recv() while flash is busy
+        self.staging = buffer_pool.borrow(4096)
+        self.view = memoryview(self.staging)
+        self.job = None
+        self.closed = False
+
+    def write(self, data):
+        # Only one write in flight so data reaches flash in order
+        data = memoryview(data)
+        offset = 0
+        while offset < len(data):
+            count = min(len(data) - offset, len(self.staging))
+            self.wait()
+            self.view[:count] = data[offset:offset + count]
+            self.job = self.pool.submit(self.file.write, self.view[:count])
+            offset += count
+
+    def wait(self):
+        if self.job is not None:
+            job = self.job
+            self.job = None
+            job.result()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.wait()
+        finally:
+            self.file.close()
+            self.buffer_pool.release(self.staging)
+            self.closed = True
+
+
+class PageCache:
+
+    def __init__(self, max_bytes=16 * 1024):
+        # Rendered page bodies keyed by page type and directory, evicted
+        # least recently used first once max_bytes is exceeded
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.pages = {}
+        self.order = []
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kind, path):
+        key = kind + ':' + path
+        page = self.pages.get(key)
+        if page is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.order.remove(key)
+        self.order.append(key)
+        return page
+
+    def put(self, kind, path, page):
+        if len(page) > self.max_bytes:
+            return
+        key = kind + ':' + path
+        self.discard(key)
+        while self.size + len(page) > self.max_bytes:
+            self.discard(self.order[0])
+        self.pages[key] = page
+        self.order.append(key)
+        self.size += len(page)
+
+    def discard(self, key):
+        page = self.pages.pop(key, None)
+        if page is not None:
+            self.order.remove(key)
+            self.size -= len(page)
+
+    def invalidate(self, path, is_dir):
+        # The parent listing always changes; a directory also takes its own
+        # listings with it and changes the tree every move page offers
+        self.discard('listing:' + dirname(path))
+        self.discard('move:' + path)
+        if is_dir:
+            own = 'listing:' + path
+            prefix = 'listing:' + path.rstrip('/') + '/'
+            for key in [key for key in self.order if key.startswith('move:')]:
+                self.discard(key)
+            for key in [key for key in self.order if key == own or key.startswith(prefix)]:
+                self.discard(key)
+
+    def stats(self):
+        return {'entries': len(self.pages), 'bytes': self.size, 'hits': self.hits, 'misses': self.misses}
+
+
+class StaticManifest:
+
+    def __init__(self, file_manager, content_type_for, enabled=True):
+        # URL path (relative to base_dir) -> (size, mtime, content_type, etag)
+        # for every file, so a static GET costs one dict lookup and no stat()
+        self.file_manager = file_manager
+        self.content_type_for = content_type_for
+        self.entries = None
+        if enabled:
+            self.rebuild()
+
+    def rebuild(self):
+        self.entries = {}
+        for item_path, is_dir, size, mtime in self.file_manager.walk('/'):
+            if not is_dir:
+                self.entries[item_path] = self.makeEntry(item_path, size, mtime)
+        print('Static manifest built with', len(self.entries), 'files')
+
+    def makeEntry(self, item_path, size, mtime):
+        return (size, mtime, self.content_type_for(item_path), '"%x-%x"' % (mtime, size))
+
+    def statEntry(self, item_path):
+        try:
+            stat = os.stat(self.file_manager.base_dir + item_path)
+        except OSError:
+            return None
+        if (stat[0] & 0x8000) != 0x8000:
+            return None
+        return self.makeEntry(item_path, stat[6], stat[8])
+
+    def lookup(self, item_path, stat_on_miss=True):
+        if self.entries is None:
+            # Manifest disabled to save memory; fall back to a stat per request
+            return self.statEntry(item_path)
+        entry = self.entries.get(item_path)
+        if entry is None and stat_on_miss:
+            # Files copied onto flash behind the server's back are picked up on first request
+            entry = self.statEntry(item_path)
+            if entry is not None:
+                self.entries[item_path] = entry
+        return entry
+
+    def update(self, path, is_dir):
+        # FileManager change listener: drop path and anything below it, then
+        # re-add whatever exists there now
+        if self.entries is None:
+            return
+        if is_dir:
+            prefix = path.rstrip('/') + '/'
+            for key in [key for key in self.entries if key.startswith(prefix)]:
+                del self.entries[key]
+            for item_path, item_is_dir, size, mtime in self.file_manager.walk(path):
+                if not item_is_dir:
+                    self.entries[item_path] = self.makeEntry(item_path, size, mtime)
+        else:
+            self.entries.pop(path, None)
+            entry = self.statEntry(path)
+            if entry is not None:
+                self.entries[path] = entry
+
+    def stats(self):
+        return {'enabled': self.entries is not None, 'files': len(self.entries or ())}
+
+
+class Profiler:
+
+    def __init__(self, max_functions=96, max_stacks=256):
+        # Fixed-size tables; calls that would add a row beyond the limits are
+        # counted in 'dropped' instead
+        self.max_functions = max_functions
+        self.max_stacks = max_stacks
+        self.originals = []
+        self.original_functions = []
+        self.reset()
+
+    def reset(self):
+        self.functions = {}
+        self.stacks = {}
+        self.thread_stacks = {}
+        self.dropped = 0
+
+    @property
+    def enabled(self):
+        return len(self.originals) > 0
+
+    def enable(self, classes, namespace=None, functions=()):
+        # Swap every public method (and the named module-level helpers in
+        # namespace) for a timing wrapper; disable() puts the originals back
+        # so an idle profiler costs nothing
+        if self.enabled:
+            return
+        for cls in classes:
+            for attr in dir(cls):
+                func = getattr(cls, attr)
+                if attr.startswith('_') or not callable(func):
+                    continue
+                self.originals.append((cls, attr, func))
+                setattr(cls, attr, self.wrap(cls.__name__ + '.' + attr, func))
+        for name in functions:
+            func = namespace[name]
+            self.original_functions.append((namespace, name, func))
+            namespace[name] = self.wrap(name, func)
+        print('Profiling enabled for', len(self.originals) + len(self.original_functions), 'functions')
+
+    def disable(self):
+        for cls, attr, func in self.originals:
+            setattr(cls, attr, func)
+        for namespace, name, func in self.original_functions:
+            namespace[name] = func
+        self.originals = []
+        self.original_functions = []
+        print('Profiling disabled')
+
+    def wrap(self, name, func):
+        profiler = self
+
+        def wrapper(*args, **kwargs):
+            return profiler.call(name, func, args, kwargs)
+        return wrapper
+
+    def call(self, name, func, args, kwargs):
+        # Generator methods are only timed while the generator is created
+        stack = self.thread_stacks.get(threadId())
+        if stack is None:
+            stack = []
+            self.thread_stacks[threadId()] = stack
+        frame = [name, 0]
+        stack.append(frame)
+        start = ticksUs()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = ticksDiff(ticksUs(), start)
+            stack.pop()
+            if stack:
+                stack[-1][1] += elapsed
+            self.record(name, stack, elapsed, elapsed - frame[1])
+
+    def record(self, name, stack, inclusive, exclusive):
+        stats = self.functions.get(name)
+        if stats is None:
+            if len(self.functions) >= self.max_functions:
+                self.dropped += 1
+                return
+            stats = [0, 0, 0]
+            self.functions[name] = stats
+        stats[0] += 1
+        stats[1] += inclusive
+        stats[2] += exclusive
+        key = ';'.join([frame[0] for frame in stack] + [name])
+        if key in self.stacks:
+            self.stacks[key] += exclusive
+        elif len(self.stacks) < self.max_stacks:
+            self.stacks[key] = exclusive
+        else:
+            self.dropped += 1
+
+    def collapsed(self):
+        # One 'caller;callee self_time_us' line per stack, as flamegraph.pl expects
+        return ''.join(key + ' ' + str(value) + '\n' for key, value in self.stacks.items())
+
+    def table(self):
+        lines = ['%-44s %8s %12s %12s' % ('function', 'calls', 'incl_us', 'excl_us')]
+        rows = sorted(self.functions.items(), key=lambda item: item[1][2], reverse=True)
+        for name, stats in rows:
+            lines.append('%-44s %8d %12d %12d' % (name, stats[0], stats[1], stats[2]))
+        if self.dropped:
+            lines.append('dropped: %d' % self.dropped)
+        return '\n'.join(lines) + '\n'
+
+
+class AdmissionController:
+
+    # Free heap (bytes) that must be available before a request of each class is accepted
+    COSTS = {'upload': 24 * 1024, 'listing': 16 * 1024, 'static': 6 * 1024, 'page': 4 * 1024}
+
+    def __init__(self, costs=None, retry_after=2):
+        self.costs = dict(self.COSTS)
+        if costs:
+            self.costs.update(costs)
+        self.retry_after = retry_after
+        self.admitted = 0
+        self.rejected = 0
+        self.rejected_by_class = {}
+        for cost_class in self.costs:
+            self.rejected_by_class[cost_class] = 0
+
+    def classify(self, request):
+        path = request.path
+        if path.startswith('/files'):
+            # Archive actions ride on the directory URL; see HTTPServer.handleFileRequest
+            action = request.query.get('action')
+            if request.method == 'POST' and (path.startswith('/files/upload') or action == 'extract'):
+                return 'upload'
+            if action == 'archive':
+                return 'static'
+        if path.startswith('/files'):
+            return 'listing'
+        if path.startswith('/admin/'):
+            return 'page'
+        return 'static'
+
+    def admit(self, cost_class):
+        # Requests are handled one at a time, so free heap is the only limit
+        required = self.costs.get(cost_class, 0)
+        free = memFree()
+        if free is not None and free < required:
+            # Only pay for a collection when the heap looks too small
+            gc.collect()
+            free = memFree()
+            if free < required:
+                return self.reject(cost_class)
+        self.admitted += 1
+        return True
+
+    def reject(self, cost_class):
+        self.rejected += 1
+        self.rejected_by_class[cost_class] = self.rejected_by_class.get(cost_class, 0) + 1
+        print('Rejected', cost_class, 'request: low memory')
+        return False
+
+    def stats(self):
+        return {
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'rejected_by_class': self.rejected_by_class,
+            'mem_free': memFree(),
+        }
+
+
 class HTTPServer:
 
-    def __init__(self, port=80):
+    # Request line and headers must fit in one pooled buffer of this size
+    HEADER_BUFFER_SIZE = 2048
+    # Body bytes read and discarded after a 503 before the socket is closed anyway
+    REJECT_DRAIN_BYTES = 64 * 1024
+
+    def __init__(self, port=80, config=None):
+        self.config = config or {}
         self.address = ('', port)
         self.template_renderer = TemplateRenderer()
         self.file_manager = FileManager()
+        self.response_writer = ResponseWriter()
+        self.buffer_pool = BufferPool(self.config.get('buffer_pool'))
+        self.worker_pool = None
+        # readAhead() and PooledWriter keep at most one job in flight, so one
+        # worker with a one-slot queue is all the pool is ever asked for
+        if self.config.get('worker_threads', 0) > 0:
+            self.worker_pool = WorkerPool(1, 1)
+        self.page_cache = PageCache(self.config.get('page_cache_bytes', 16 * 1024))
+        self.file_manager.addChangeListener(self.page_cache.invalidate)
+        self.content_types = dict(CONTENT_TYPES)
+        self.content_types.update(self.config.get('mime_types', {}))
+        self.static_manifest = StaticManifest(self.file_manager, self.getContentType, self.config.get('static_manifest', True))
+        self.file_manager.addChangeListener(self.static_manifest.update)
+        self.admission = AdmissionController(
+            self.config.get('admission_costs'),
+            self.config.get('retry_after', 2)
+        )
+        self.profiler = Profiler()
+        if self.config.get('profile', False):
+            self.startProfiling()
         self.socket = socket.socket()
         self.socket.bind(self.address)
         self.socket.listen(5)  # Increased backlog for better handling
         print('Server listening on port', port)
     
     def getContentType(self, file_path):
-        if file_path.endswith('.html'):
-            return 'text/html'
-        elif file_path.endswith('.jpg') or file_path.endswith('.jpeg'):
-            return 'image/jpeg'
-        elif file_path.endswith('.png'):
-            return 'image/png'
-        elif file_path.endswith('.gif'):
-            return 'image/gif'
-        elif file_path.endswith('.css'):
-            return 'text/css'
-        elif file_path.endswith('.js'):
-            return 'application/javascript'
-        else:
+        # An extension containing '/' (a dot in a directory name) simply misses the table
+        dot = file_path.rfind('.')
+        if dot == -1:
             return 'application/octet-stream'
+        return self.content_types.get(file_path[dot:], 'application/octet-stream')
 
 
     def serveForever(self):
@@ -306,65 +1211,82 @@ class HTTPServer:
                 print('Error accepting client:', e)
 
     def handleClient(self, client_sock):
+        # The request is parsed and handled inside the pooled header buffer,
+        # which is only given back once the response has been sent
+        buffer = self.buffer_pool.borrow(self.HEADER_BUFFER_SIZE)
+        body_buffer = None
         try:
             # Read request line and headers
-            header_data = b''
-            while True:
-                chunk = client_sock.recv(1024)
-                if not chunk:
+            view = memoryview(buffer)
+            length = 0
+            headers_end = -1
+            while length < len(buffer):
+                count = recvInto(client_sock, view[length:])
+                if not count:
                     break
-                header_data += chunk
-                if b'\r\n\r\n' in header_data:
-                    headers_end = header_data.find(b'\r\n\r\n') + 4
+                # Search only the new bytes plus the three before them
+                start = max(0, length - 3)
+                length += count
+                found = findBytes(buffer, b'\r\n\r\n', start, length)
+                if found != -1:
+                    headers_end = found + 4
                     break
 
-            if not header_data:
+            if not length:
                 print('No data received from client.')
                 return
-
-            header_text = header_data[:headers_end].decode('utf-8', 'ignore')
-            lines = header_text.split('\r\n')
-            request_line = lines[0]
-            headers = {}
-            for line in lines[1:]:
-                if line == '':
-                    continue
-                if ':' in line:
-                    key, value = line.split(':', 1)
-                    headers[key.strip().lower()] = value.strip()
-
+            if headers_end == -1:
+                if length == len(buffer):
+                    self.sendResponse(client_sock, '<h1>Request headers too large</h1>', status='431 Request Header Fields Too Large')
+                    return
+                headers_end = length
+
+            request_end = findBytes(buffer, b'\r\n', 0, headers_end)
+            if request_end == -1:
+                request_end = headers_end
+            request_line = str(view[:request_end], 'utf-8', 'ignore')
             method, path, params = self.parseRequestLine(request_line)
             print(f"Method: {method}, Path: {path}, Params: {params}")
+            # Header lookups search from the CRLF that ends the request line
+            request = Request(method, path, params, buffer, request_end, headers_end)
+
+            # Shed load before reading a body or touching flash
+            if not self.admission.admit(self.admission.classify(request)):
+                self.sendServiceUnavailable(client_sock)
+                # Closing with body bytes unread sends a reset that can discard the 503
+                self.drainBody(client_sock, view, request.contentLength - (length - headers_end))
+                return
 
-            content_length = int(headers.get('content-length', 0))
-            content_type = headers.get('content-type', '')
+            content_length = request.contentLength
             print(f"Content-Length: {content_length}")
 
             # Now, for methods that have body (e.g., POST), need to handle body
             if method == 'POST':
-                remaining_data = header_data[headers_end:]
-                if path.startswith('/files/upload'):
-                    # For file upload, pass socket and remaining data to handler
-                    self.handleFileRequest(client_sock, method, path, params, headers, remaining_data)
+                remaining_data = view[headers_end:length]
+                if path.startswith('/files/upload') or request.query.get('action') == 'extract':
+                    # For file and archive uploads, pass socket and remaining data to handler
+                    request.body = remaining_data
                 else:
-                    # For other POST requests, read body into memory
-                    body_data = remaining_data
-                    bytes_to_read = content_length - len(remaining_data)
-                    while bytes_to_read > 0:
-                        chunk = client_sock.recv(1024)
-                        if not chunk:
+                    # For other POST requests, read the body into a pooled buffer
+                    body_length = max(content_length, len(remaining_data))
+                    body_buffer = self.buffer_pool.borrow(body_length)
+                    body_view = memoryview(body_buffer)
+                    body_view[:len(remaining_data)] = remaining_data
+                    received = len(remaining_data)
+                    while received < content_length:
+                        count = recvExactly(client_sock, body_view[received:content_length])
+                        if not count:
                             break
-                        body_data += chunk
-                        bytes_to_read -= len(chunk)
-                    # Now pass body_data to handler
-                    self.handleFileRequest(client_sock, method, path, params, headers, body_data)
-            else:
-                # For GET or other methods
-                self.handleFileRequest(client_sock, method, path, params, headers, None)
+                        received += count
+                    request.body = body_view[:received]
+            self.handleFileRequest(client_sock, request)
         except Exception as e:
             print('Unhandled exception in handleClient:', e)
             self.sendResponse(client_sock, '<h1>Internal Server Error</h1>', content_type='text/html', status='500 Internal Server Error')
         finally:
+            if body_buffer is not None:
+                self.buffer_pool.release(body_buffer)
+            self.buffer_pool.release(buffer)
             client_sock.close()
             print('Client socket closed')
 
@@ -373,67 +1295,175 @@ class HTTPServer:
         if len(parts) >= 2:
             method = parts[0]
             full_path = parts[1]
-            try:
-                params = '?' + full_path.split('?')[1]
-            except IndexError:
-                params = ''
-            # Remove query parameters from path
-            path = full_path.split('?')[0]
-            return method, path, params
+            # Split off the query string once; params keeps its leading '?'
+            query_start = full_path.find('?')
+            if query_start == -1:
+                return method, full_path, ''
+            return method, full_path[:query_start], full_path[query_start:]
         return 'GET', '/', ''  # Default values
 
-    def sendResponse(self, client_sock, content, content_type='text/html', status='200 OK'):
-        if isinstance(content, str):
-            content = content.encode('utf-8')
-        content_length = len(content)
-        response_header = f'HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {content_length}\r\nConnection: close\r\n\r\n'
+    def sendResponse(self, client_sock, content, content_type='text/html', status='200 OK', headers=None):
         try:
-            client_sock.send(response_header.encode('utf-8'))
-            client_sock.send(content)
+            self.response_writer.sendResponse(client_sock, content, content_type, status, headers)
             print(f"Sent response with status {status}")
         except Exception as e:
             print('Error sending response:', e)
     
-    def sendResponseStream(self, client_sock, content_generator, content_type='application/octet-stream', status='200 OK', content_length=None):
-        headers = f'HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n'
-        if content_length is not None:
-            headers += f'Content-Length: {content_length}\r\n'
-        headers += 'Connection: close\r\n\r\n'
+    def sendResponseStream(self, client_sock, content_generator, content_type='application/octet-stream', status='200 OK', content_length=None, headers=None):
         try:
-            client_sock.send(headers.encode('utf-8'))
-            for chunk in content_generator:
-                client_sock.send(chunk)
+            self.response_writer.sendStream(client_sock, content_generator, content_type, status, content_length, headers)
             print(f"Sent streamed response with status {status}")
         except Exception as e:
             print('Error sending streamed response:', e)
 
-    def streamFile(self, file_path, chunk_size=1024):
+    def openForWrite(self, file_path):
+        # With workers the flash write of one chunk overlaps receiving the next
+        f = open(file_path, 'wb')
+        if self.worker_pool is None:
+            return f
+        return PooledWriter(self.worker_pool, f, self.buffer_pool)
+
+    def readAhead(self, generator):
+        # Produce the next item on a worker while the caller sends this one.
+        # The generator must not reuse an item's buffer for the item after it,
+        # and must not yield None
+        if self.worker_pool is None:
+            yield from generator
+            return
+        job = self.worker_pool.submit(nextItem, generator)
+        try:
+            while True:
+                item = job.result()
+                job = None
+                if item is None:
+                    break
+                job = self.worker_pool.submit(nextItem, generator)
+                yield item
+        finally:
+            if job is not None:
+                try:
+                    job.result()
+                except Exception:
+                    pass
+            generator.close()
+
+    def readChunks(self, f, views, remaining=-1):
+        # Reads into the views in turn; with two of them the read-ahead never
+        # overwrites the chunk still being sent. remaining=-1 reads to the end
+        current = 0
+        while remaining != 0:
+            view = views[current]
+            if 0 < remaining < len(view):
+                view = view[:remaining]
+            count = f.readinto(view)
+            if not count:
+                break
+            if remaining > 0:
+                remaining -= count
+            yield view[:count]
+            current = (current + 1) % len(views)
+
+    def borrowChunkViews(self, chunk_size):
+        # Read-ahead needs a second buffer so one can fill while the other is sent
+        buffers = [self.buffer_pool.borrow(chunk_size)]
+        if self.worker_pool is not None:
+            buffers.append(self.buffer_pool.borrow(chunk_size))
+        return buffers, [memoryview(buffer)[:chunk_size] for buffer in buffers]
+
+    def streamFile(self, file_path, chunk_size=1024, length=-1):
+        # Chunks are views into pooled buffers and stay valid only until the
+        # next chunk is requested. A length stops the stream there, so a file
+        # that grew since its Content-Length was taken cannot overrun it
+        buffers, views = self.borrowChunkViews(chunk_size)
         try:
             with open(file_path, 'rb') as f:
-                while True:
-                    chunk = f.read(chunk_size)
-                    if not chunk:
-                        break
-                    yield chunk
+                yield from self.readAhead(self.readChunks(f, views, length))
         except Exception as e:
             print('Error streaming file:', e)
+        finally:
+            for buffer in buffers:
+                self.buffer_pool.release(buffer)
+
+    def streamArchive(self, dir_path, chunk_size=1024):
+        # Tar of dir_path generated on the fly: one header per entry, file
+        # bodies read in chunk_size pieces, so memory use is independent of size.
+        # Run it through readAhead() to walk and read on a worker
+        buffers, views = self.borrowChunkViews(chunk_size)
+        zeros = memoryview(bytes(chunk_size))
+        try:
+            if dir_path == '/':
+                # Entries are relative to '/files', so extracting into '/' restores them in place
+                root = ''
+                prefix_length = 1
+            else:
+                # Entries start with the directory's own name; extract into its parent
+                root = basename(dir_path)
+                prefix_length = len(dir_path)
+                yield tarHeader(root, True, 0, int(time.time()))
+            for item_path, is_dir, size, mtime in self.file_manager.walk(dir_path):
+                header = tarHeader(root + item_path[prefix_length:], is_dir, size, mtime)
+                if header is None:
+                    print('Skipping', item_path, '(name too long for tar)')
+                    continue
+                yield header
+                if is_dir:
+                    continue
+                remaining = size
+                try:
+                    with open(self.file_manager.base_dir + item_path, 'rb') as f:
+                        for chunk in self.readChunks(f, views, size):
+                            remaining -= len(chunk)
+                            yield chunk
+                except OSError as e:
+                    print('Error reading', item_path, 'for archive:', e)
+                # The header promised size bytes; pad if the file shrank meanwhile
+                while remaining > 0:
+                    padding = min(chunk_size, remaining)
+                    remaining -= padding
+                    yield zeros[:padding]
+                if size % 512:
+                    yield zeros[:512 - size % 512]
+            yield zeros[:512]
+            yield zeros[:512]
+        finally:
+            for buffer in buffers:
+                self.buffer_pool.release(buffer)
 
     def send404(self, client_sock):
         content = '<h1>404 - Page Not Found</h1>'
         self.sendResponse(client_sock, content, content_type='text/html', status='404 Not Found')
 
+    def sendServiceUnavailable(self, client_sock):
+        content = '<h1>503 - Service Unavailable</h1>'
+        headers = {'Retry-After': self.admission.retry_after}
+        self.sendResponse(client_sock, content, content_type='text/html', status='503 Service Unavailable', headers=headers)
+
+    def drainBody(self, client_sock, view, remaining):
+        # Reads into the caller's scratch view, up to REJECT_DRAIN_BYTES and
+        # giving up on a client that stops sending
+        remaining = min(remaining, self.REJECT_DRAIN_BYTES)
+        try:
+            client_sock.settimeout(1)
+            while remaining > 0:
+                count = recvInto(client_sock, view[:min(len(view), remaining)])
+                if not count:
+                    break
+                remaining -= count
+        except OSError as e:
+            print('Stopped draining request body:', e)
+
     def sendRedirect(self, client_sock, location):
-        response_header = f'HTTP/1.1 303 See Other\r\nLocation: {location}\r\nContent-Length: 0\r\n\r\n'
         try:
-            client_sock.send(response_header.encode('utf-8'))
+            self.response_writer.sendRedirect(client_sock, location)
             print(f"Redirected to {location}")
         except Exception as e:
             print('Error sending redirect:', e)
 
-    def handleFileRequest(self, client_sock, method, path, params, headers, body):
-
-        sub_path = sanitizePath(urlDecode(path[len('/files'):]))
-        if (urlDecode(path).startswith("/files")):
+    def handleFileRequest(self, client_sock, request):
+        method = request.method
+        path = request.path
+        sub_path = request.subPath
+        if (request.decodedPath.startswith("/files")):
             if method == 'GET':
                 if path == '/':
                     context = {'title': 'Home Page'}
@@ -442,53 +1472,47 @@ class HTTPServer:
                         self.sendResponse(client_sock, response)
                     else:
                         self.send404(client_sock)
+                elif request.query.get('action') == 'archive':
+                    # A query flag on the directory's own URL cannot collide with a directory name
+                    print('Archive request for:', sub_path)
+                    self.handleArchiveDownload(client_sock, sub_path)
                 elif path.startswith('/files/delete/'):
                     item_path = sub_path[len('/delete'):]
-                    item_path = urlDecode(item_path.split('?')[0])
                     print('Delete request for:', item_path)
-                    self.file_manager.deleteItem(item_path.split('?')[0])
+                    self.file_manager.deleteItem(item_path)
                     parent_dir = dirname(item_path)
                     self.sendRedirect(client_sock, '/files' + parent_dir)
                 elif path.startswith('/files/rename/'):
                     item_path = sub_path[len('/rename'):]
-                    item_path = urlDecode(item_path.split('?')[0])
                     print('Rename request for:', item_path)
-                    self.showRenameForm(client_sock, item_path.split('?')[0])
+                    self.showRenameForm(client_sock, item_path)
                 elif path.startswith('/files/create_dir/'):
                     dir_path = sub_path[len('/create_dir'):]
                     print('Create directory request for:', dir_path)
                     self.showCreateDirForm(client_sock, dir_path)
                 elif path.startswith('/files/move/'):
                     item_path = sub_path[len('/move'):]
-                    item_path = urlDecode(item_path.split('?')[0])
                     print('Move request for:', item_path)
-                    self.showMoveSelection(client_sock, item_path.split('?')[0])
+                    self.showMoveSelection(client_sock, item_path)
                 elif path.startswith('/files/move_confirm'):
                     print("Move confirm request received.")
-                    item_path = sub_path[len('/move_confirm'):]
-                    item_path = urlDecode(item_path.split('?')[0])
-                    if (params):
-                        params_dict = self.parseQueryString(params.lstrip("?/"))
-                        print("Params:", params_dict)
-                        dest_dir = params_dict.get('dest_dir', '/')
-                    else:
-                        dest_dir = '/'
-                    self.handleMoveConfirm(client_sock, item_path, dest_dir)
+                    self.handleMoveConfirm(client_sock, request)
                 elif isDir(self.file_manager.base_dir + sub_path):
                     print("Show file manager request received.")
                     self.showFileManager(client_sock, sub_path)
 
             elif method == 'POST':
-                if path.startswith('/files/upload'):
-                    current_dir = sub_path[len('/upload'):]
-                    current_dir = sanitizePath(current_dir)
+                if request.query.get('action') == 'extract':
+                    print('Archive extract to directory:', sub_path)
+                    self.handleArchiveUpload(client_sock, request, sub_path)
+                elif path.startswith('/files/upload'):
+                    current_dir = sanitizePath(sub_path[len('/upload'):])
                     print('File upload to directory:', current_dir)
-                    content_length = int(headers.get('content-length', 0))
-                    self.handleFileUpload(client_sock, headers, current_dir, content_length, body)
+                    self.handleFileUpload(client_sock, request, current_dir)
                 elif path.startswith('/files/rename/'):
                     item_path = sub_path[len('/rename'):]
                     print('Processing rename for:', item_path)
-                    form_data = self.parseFormData(body)
+                    form_data = self.parseFormData(request.body)
                     if 'new_name' in form_data:
                         new_name = form_data['new_name']
                         self.file_manager.renameItem(item_path, new_name)
@@ -499,7 +1523,7 @@ class HTTPServer:
                 elif path.startswith('/files/create_dir/'):
                     dir_path = sub_path[len('/create_dir'):]
                     print('Processing create directory in:', dir_path)
-                    form_data = self.parseFormData(body)
+                    form_data = self.parseFormData(request.body)
                     if 'dir_name' in form_data:
                         new_dir = dir_path + '/' + form_data['dir_name']
                         self.file_manager.createDirectory(new_dir)
@@ -510,50 +1534,125 @@ class HTTPServer:
                     self.send404(client_sock)
             else:
                 self.send404(client_sock)
+        elif path.startswith('/admin/'):
+            self.handleAdmin(client_sock, request)
         else:
             print("Handle custom file received.")
-            self.handleCustomPaths(client_sock, method, path)
+            self.handleCustomPaths(client_sock, request)
+
+    def handleAdmin(self, client_sock, request):
+        if request.method == 'GET' and request.path == '/admin/stats':
+            self.sendResponse(client_sock, json.dumps(self.getStats()), content_type='application/json')
+        elif request.method == 'GET' and request.path == '/admin/profile':
+            self.handleProfile(client_sock, request)
+        elif request.method == 'GET' and request.path == '/admin/refresh':
+            self.handleRefresh(client_sock, request)
+        else:
+            self.send404(client_sock)
+
+    def handleRefresh(self, client_sock, request):
+        # Files written to flash outside FileManager (e.g. by the device's own
+        # code) reach the manifest and page cache only when reported here.
+        # Anything that is not a file is refreshed as a directory, which also
+        # drops the entries below a directory that has been removed
+        path = sanitizePath(request.query.get('path', '/'))
+        is_dir = not isFile(self.file_manager.base_dir + path)
+        self.file_manager.notifyChange(path, is_dir)
+        print('Refreshed', path)
+        self.sendResponse(client_sock, json.dumps(self.static_manifest.stats()), content_type='application/json')
+
+    def handleProfile(self, client_sock, request):
+        # /admin/profile?action=start|stop|reset, ?format=table, or the
+        # collapsed stacks by default
+        action = request.query.get('action')
+        if action == 'start':
+            self.startProfiling()
+        elif action == 'stop':
+            self.profiler.disable()
+        elif action == 'reset':
+            self.profiler.reset()
+        elif action is not None:
+            self.sendResponse(client_sock, 'Unknown action\n', content_type='text/plain', status='400 Bad Request')
+            return
+        if action is not None:
+            self.sendResponse(client_sock, 'Profiling ' + ('on' if self.profiler.enabled else 'off') + '\n', content_type='text/plain')
+        elif request.query.get('format') == 'table':
+            self.sendResponse(client_sock, self.profiler.table(), content_type='text/plain')
+        else:
+            self.sendResponse(client_sock, self.profiler.collapsed(), content_type='text/plain')
+
+    def startProfiling(self):
+        self.profiler.enable(
+            (HTTPServer, FileManager, TemplateRenderer),
+            globals(),
+            ('exists', 'isDir', 'isFile', 'sanitizePath', 'dirname', 'basename',
+             'urlEncode', 'urlDecode', 'parseQueryString')
+        )
+
+    def getStats(self):
+        return {
+            'admission': self.admission.stats(),
+            'page_cache': self.page_cache.stats(),
+            'buffer_pool': self.buffer_pool.stats(),
+            'static_manifest': self.static_manifest.stats(),
+            'largest_free_block': largestFreeBlock(),
+        }
     
-    def handleCustomPaths(self, client_sock, method, path):
-        if method != 'GET':
+    def handleCustomPaths(self, client_sock, request):
+        if request.method != 'GET':
             self.send404(client_sock)
             return
     
-        decoded_path = urlDecode(path)
-        sanitized_path = sanitizePath(decoded_path)
-        sanitized_path = sanitized_path.lstrip('/')
-        if (len(sanitized_path) < 1):
-            sanitized_path = "index"
+        sanitized_path = sanitizePath(request.decodedPath)
+        if sanitized_path == '/':
+            sanitized_path = '/index'
 
         if (sanitized_path.find(".") < 0):
             sanitized_path = sanitized_path + '.html'
 
-        full_file_path = self.file_manager.base_dir + '/' + sanitized_path
-        full_file_path = sanitizePath(full_file_path)
-
-        if isFile(full_file_path):
-            content_type = self.getContentType(full_file_path)
-            file_size = os.stat(full_file_path)[6]
-            self.sendResponseStream(
-                client_sock,
-                self.streamFile(full_file_path),
-                content_type=content_type,
-                content_length=file_size
-            )
-        else:
+        entry = self.static_manifest.lookup(sanitized_path)
+        if entry is None:
             self.send404(client_sock)
+            return
+        file_size, mtime, content_type, etag = entry
+        headers = {'ETag': etag}
+
+        # Serve a precompressed 'name.gz' sibling to clients that accept gzip. Both
+        # variants carry Vary so caches keep them apart. Most files have no sibling,
+        # so a manifest miss is final here rather than costing a stat per request
+        compressed = self.static_manifest.lookup(sanitized_path + '.gz', stat_on_miss=False)
+        if compressed is not None:
+            headers['Vary'] = 'Accept-Encoding'
+            if 'gzip' in request.header('accept-encoding'):
+                sanitized_path += '.gz'
+                file_size, mtime, _, etag = compressed
+                headers['ETag'] = etag
+                headers['Content-Encoding'] = 'gzip'
+
+        if request.header('if-none-match') == etag:
+            self.sendResponse(client_sock, b'', content_type=None, status='304 Not Modified', headers=headers)
+            return
 
-    def handleFileUpload(self, client_sock, headers, current_dir, content_length, initial_data):
+        self.sendResponseStream(
+            client_sock,
+            self.streamFile(self.file_manager.base_dir + sanitized_path, length=file_size),
+            content_type=content_type,
+            content_length=file_size,
+            headers=headers
+        )
+
+    def handleFileUpload(self, client_sock, request, current_dir):
+        f = None
+        saved = []
+        recv_buffer = self.buffer_pool.borrow(4096)
+        recv_view = memoryview(recv_buffer)
         try:
             print('Handling file upload...')
             print('Attempting to save to:', current_dir)
             gc.collect()
-            print('Memory before upload:', gc.mem_free())
+            print('Memory before upload:', memFree())
 
-            if current_dir == '/':
-                current_dir = '/files'
-
-            content_type_header = headers.get('content-type', '')
+            content_type_header = request.header('content-type')
             if 'multipart/form-data' not in content_type_header:
                 print('Invalid Content-Type for upload:', content_type_header)
                 self.sendResponse(client_sock, '<h1>Invalid form submission</h1>', status='400 Bad Request')
@@ -564,90 +1663,88 @@ class HTTPServer:
             boundary_bytes = boundary.encode('utf-8')
             print('Boundary:', boundary)
 
-            # Define the boundary markers
+            # Define the boundary markers; the delimiter before every boundary
+            # after the first is CRLF, and '--' after a boundary ends the body
             start_boundary = b'--' + boundary_bytes
-            end_boundary = b'--' + boundary_bytes + b'--'
-
-            bytes_read = len(initial_data)
-            buffer = initial_data
+            delimiter = b'\r\n' + start_boundary
+
+            # The unparsed bytes are recv_buffer[start:end]; they are searched in
+            # place and shifted to the front before the next recv
+            content_length = request.contentLength
+            end = len(request.body)
+            recv_view[:end] = request.body
+            start = 0
+            bytes_read = end
             state = 'searching_start_boundary'
             filename = None
-            f = None
 
             while True:
                 while True:
                     if state == 'searching_start_boundary':
-                        index = buffer.find(start_boundary)
+                        index = findBytes(recv_buffer, start_boundary, start, end)
                         if index != -1:
-                            buffer = buffer[index + len(start_boundary):]
-                            state = 'parsing_headers'
+                            start = index + len(start_boundary)
+                            state = 'after_boundary'
                         else:
-                            if len(buffer) > len(start_boundary):
-                                buffer = buffer[-len(start_boundary):]
+                            # Keep what could be the beginning of a split boundary
+                            start = max(start, end - len(start_boundary) + 1)
                             break
+                    elif state == 'after_boundary':
+                        if end - start < 2:
+                            break
+                        if recv_buffer[start] == 45 and recv_buffer[start + 1] == 45:  # '--'
+                            state = 'done'
+                            break
+                        start += 2
+                        state = 'parsing_headers'
                     elif state == 'parsing_headers':
-                        headers_end = buffer.find(b'\r\n\r\n')
+                        headers_end = findBytes(recv_buffer, b'\r\n\r\n', start, end)
                         if headers_end != -1:
-                            part_headers = buffer[:headers_end].decode('utf-8', 'ignore')
-                            buffer = buffer[headers_end + 4:]
+                            part_headers = str(recv_view[start:headers_end], 'utf-8', 'ignore')
+                            start = headers_end + 4
                             filename = self.parsePartHeaders(part_headers)
                             if filename:
-                                if current_dir != '/files':
-                                    current_dir = '/files' + current_dir
-
-                                if not current_dir.endswith('/'):
-                                    current_dir += '/'
-
-                                save_path = current_dir + filename
+                                file_path = sanitizePath(current_dir + '/' + filename)
+                                save_path = self.file_manager.base_dir + file_path
                                 print("Saving to:", save_path)
                                 try:
-                                    f = open(save_path, 'wb')
+                                    f = self.openForWrite(save_path)
                                 except Exception as e:
                                     print('Error opening file for writing:', e)
                                     self.sendResponse(client_sock, '<h1>File write error</h1>', status='500 Internal Server Error')
                                     return
+                                saved.append(file_path)
                                 state = 'writing_file'
                             else:
                                 state = 'skipping_part'
                         else:
                             break
                     elif state == 'writing_file':
-                        next_boundary_index = buffer.find(b'\r\n' + start_boundary)
-                        end_boundary_index = buffer.find(b'\r\n' + end_boundary)
+                        index = findBytes(recv_buffer, delimiter, start, end)
                         print(".", end="")
-                        if next_boundary_index != -1:
-                            f.write(buffer[:next_boundary_index])
+                        if index != -1:
+                            f.write(recv_view[start:index])
                             f.close()
                             print()
                             print('File saved to:', save_path)
-                            buffer = buffer[next_boundary_index + 2:]
-                            state = 'parsing_headers'
+                            start = index + len(delimiter)
+                            state = 'after_boundary'
                             filename = None
                             f = None
-                        elif end_boundary_index != -1:
-                            f.write(buffer[:end_boundary_index])
-                            f.close()
-                            print()
-                            print('File saved to:', save_path)
-                            buffer = buffer[end_boundary_index + 2:]
-                            state = 'done'
-                            break
                         else:
-                            f.write(buffer)
-                            buffer = b''
+                            # Write all but what could be the start of a split delimiter
+                            safe_end = end - len(delimiter) + 1
+                            if safe_end > start:
+                                f.write(recv_view[start:safe_end])
+                                start = safe_end
                             break
                     elif state == 'skipping_part':
-                        next_boundary_index = buffer.find(b'\r\n' + start_boundary)
-                        end_boundary_index = buffer.find(b'\r\n' + end_boundary)
-                        if next_boundary_index != -1:
-                            buffer = buffer[next_boundary_index + 2:]
-                            state = 'parsing_headers'
-                        elif end_boundary_index != -1:
-                            buffer = buffer[end_boundary_index + 2:]
-                            state = 'done'
-                            break
+                        index = findBytes(recv_buffer, delimiter, start, end)
+                        if index != -1:
+                            start = index + len(delimiter)
+                            state = 'after_boundary'
                         else:
-                            buffer = b''
+                            start = max(start, end - len(delimiter) + 1)
                             break
                     elif state == 'done':
                         break
@@ -660,10 +1757,15 @@ class HTTPServer:
                 if bytes_read >= content_length:
                     # No more data to read
                     break
+                end = shiftDown(recv_buffer, start, end)
+                start = 0
+                if end == len(recv_buffer):
+                    print('Multipart part headers too large')
+                    break
                 else:
                     # Need to read more data from socket
                     try:
-                        chunk = client_sock.recv(4096)
+                        count = recvExactly(client_sock, recv_view[end:min(len(recv_view), end + content_length - bytes_read)])
                     except OSError as e:
                         print('Socket error:', e)
                         if e.args[0] == errno.ETIMEDOUT:
@@ -671,21 +1773,28 @@ class HTTPServer:
                             break
                         else:
                             raise
-                    if not chunk:
+                    if not count:
                         break
-                    bytes_read += len(chunk)
-                    buffer += chunk
+                    bytes_read += count
+                    end += count
 
             # After the loop, handle any remaining data
             if f:
                 if not f.closed:
                     # Write any remaining data in the buffer
-                    f.write(buffer)
+                    f.write(recv_view[start:end])
                     f.close()
                     print('File saved to:', save_path)
                 state = 'done'
 
-            print('Memory after upload:', gc.mem_free())
+            # Read past the epilogue so the redirect is not lost to a connection reset
+            while bytes_read < content_length:
+                count = recvExactly(client_sock, recv_view[:min(len(recv_view), content_length - bytes_read)])
+                if not count:
+                    break
+                bytes_read += count
+
+            print('Memory after upload:', memFree())
         except Exception as e:
             print('Error handling file upload:', e)
             self.sendResponse(client_sock, '<h1>File upload failed</h1>', status='500 Internal Server Error')
@@ -693,8 +1802,99 @@ class HTTPServer:
             # Ensure file is closed
             if f and f is not None and not f.closed:
                 f.close()
-            self.sendRedirect(client_sock, current_dir)
+            self.buffer_pool.release(recv_buffer)
+            # Uploads bypass FileManager, so report the new files here
+            for file_path in saved:
+                self.file_manager.notifyChange(file_path, False)
+            self.sendRedirect(client_sock, '/files' + current_dir)
+
+
+    def handleArchiveDownload(self, client_sock, dir_path):
+        if not isDir(self.file_manager.base_dir + dir_path):
+            self.send404(client_sock)
+            return
+        filename = (basename(dir_path) or 'files') + '.tar'
+        self.sendResponseStream(
+            client_sock,
+            self.readAhead(self.streamArchive(dir_path)),
+            content_type='application/x-tar',
+            headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+        )
 
+    def handleArchiveUpload(self, client_sock, request, target_dir):
+        # Raw tar body (e.g. curl --data-binary @dir.tar) unpacked into target_dir
+        if not isDir(self.file_manager.base_dir + target_dir):
+            self.send404(client_sock)
+            return
+        reader = BodyReader(client_sock, request.body, request.contentLength)
+        # Headers and file data are read into the same two buffers for every entry
+        header = bytearray(512)
+        empty = bytes(512)
+        buffer = self.buffer_pool.borrow(1024)
+        view = memoryview(buffer)[:1024]
+        extracted = 0
+        valid = True
+        try:
+            while True:
+                if reader.readinto(header) < 512 or header == empty:
+                    break
+                entry = parseTarHeader(header)
+                if entry is None:
+                    print('Invalid tar header after', extracted, 'entries')
+                    valid = False
+                    break
+                name, typeflag, size = entry
+                item_path = sanitizePath(target_dir + '/' + name)
+                padded_size = size + (512 - size % 512) % 512
+                if typeflag == '5':
+                    self.createDirectories(item_path)
+                elif typeflag in ('0', '\0') and item_path != target_dir:
+                    self.createDirectories(dirname(item_path))
+                    self.extractFile(reader, item_path, size, view)
+                    padded_size -= size
+                else:
+                    # Links, pax and GNU extension records are skipped
+                    print('Skipping tar entry', name, 'of type', typeflag)
+                while padded_size > 0:
+                    count = reader.readinto(view[:min(len(view), padded_size)])
+                    if not count:
+                        break
+                    padded_size -= count
+                extracted += 1
+            # Consume the rest of the body (tar writers pad with zero records) so
+            # the reply is not lost to a connection reset
+            while reader.readinto(view):
+                pass
+        finally:
+            self.buffer_pool.release(buffer)
+        print('Extracted', extracted, 'entries to', target_dir)
+        if valid:
+            self.sendRedirect(client_sock, '/files' + target_dir)
+        else:
+            self.sendResponse(client_sock, '<h1>Invalid archive</h1>', status='400 Bad Request')
+
+    def createDirectories(self, dir_path):
+        current = ''
+        for segment in dir_path.strip('/').split('/'):
+            if segment:
+                current += '/' + segment
+                if not isDir(self.file_manager.base_dir + current):
+                    self.file_manager.createDirectory(current)
+
+    def extractFile(self, reader, item_path, size, view):
+        f = self.openForWrite(self.file_manager.base_dir + item_path)
+        try:
+            remaining = size
+            while remaining > 0:
+                count = reader.readinto(view[:min(len(view), remaining)])
+                if not count:
+                    break
+                f.write(view[:count])
+                remaining -= count
+        finally:
+            f.close()
+        print('File saved to:', item_path)
+        self.file_manager.notifyChange(item_path, False)
 
     def parsePartHeaders(self, part_headers_text):
         lines = part_headers_text.split('\r\n')
@@ -712,6 +1912,10 @@ class HTTPServer:
             return None
 
     def showFileManager(self, client_sock, current_dir):
+        cached = self.page_cache.get('listing', current_dir)
+        if cached is not None:
+            self.sendResponse(client_sock, cached)
+            return
         items = self.file_manager.listItems(current_dir)
         content = '<html><body>'
         content += f'<h1>Index of /files{current_dir}</h1>'
@@ -783,8 +1987,11 @@ class HTTPServer:
             '</form>'
         )
 
+        content += f'<br><a href="/files{urlEncode(current_dir)}?action=archive">Download directory (.tar)</a>'
         content += '<br><a href="/">Go Home</a>'
         content += '</body></html>'
+        content = content.encode('utf-8')
+        self.page_cache.put('listing', current_dir, content)
         self.sendResponse(client_sock, content)
 
 
@@ -811,6 +2018,10 @@ class HTTPServer:
         self.sendResponse(client_sock, content)
 
     def showMoveSelection(self, client_sock, item_path):
+        cached = self.page_cache.get('move', item_path)
+        if cached is not None:
+            self.sendResponse(client_sock, cached)
+            return
         current_dir = dirname(item_path)
         directories = self.getAllDirectories('/', exclude=[current_dir, item_path])
         directories.insert(0, "/")
@@ -825,12 +2036,14 @@ class HTTPServer:
         content += '</ul>'
         content += f'<br><a href="/files{current_dir}">Cancel</a>'
         content += '</body></html>'
+        content = content.encode('utf-8')
+        self.page_cache.put('move', item_path, content)
         self.sendResponse(client_sock, content)
 
-    def handleMoveConfirm(self, client_sock, item_path, dest_dir):
-        item_path = urlDecode(item_path)
-        print(dest_dir)
-        dest_dir = urlDecode(dest_dir)
+    def handleMoveConfirm(self, client_sock, request):
+        # Both values come out of the Request already decoded
+        item_path = request.subPath[len('/move_confirm'):]
+        dest_dir = request.query.get('dest_dir', '/')
         print('handleMoveConfirm called with:')
         print('item_path:', item_path)
         print('dest_dir:', dest_dir)
@@ -840,40 +2053,18 @@ class HTTPServer:
     def parseFormData(self, body):
         form_data = {}
         try:
-            request_str = body.decode('utf-8', 'ignore')
-            pairs = request_str.split('&')
-            for pair in pairs:
-                if '=' in pair:
-                    key, value = pair.split('=', 1)
-                    key = key.replace('+', ' ')
-                    value = value.replace('+', ' ')
-                    key = urlDecode(key)
-                    value = urlDecode(value)
-                    form_data[key] = value
+            form_data = parseQueryString(str(body, 'utf-8', 'ignore'))
         except Exception as e:
             print('Error parsing form data:', e)
         return form_data
 
-    def parseQueryString(self, query_string):
-        params = {}
-        pairs = query_string.split('&')
-        for pair in pairs:
-            if '=' in pair:
-                key, value = pair.split('=', 1)
-                key = key.replace('+', ' ')
-                value = value.replace('+', ' ')
-                key = urlDecode(key)
-                value = urlDecode(value)
-                params[key] = value
-        return params
-
     def getAllDirectories(self, path='/', exclude=[]):
         return self.file_manager.getAllDirectories(path, exclude)
 
 def main():
     config = readConfig()
     wifi = WiFiConnection(config['wifi_name'],  config['wifi_password'])  # Replace with your WiFi credentials
-    server = HTTPServer()
+    server = HTTPServer(config=config)
     server.serveForever()
 
 if __name__ == '__main__':